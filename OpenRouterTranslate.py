@@ -1,8 +1,99 @@
 # Implementation of OpenRouterTranslate using OpenRouter API with Gemma 3 model
 
 import os
+import re
+import atexit
+import asyncio
+import functools
+import threading
+from concurrent.futures import Future
+import httpx
 import openai
+from aiolimiter import AsyncLimiter
 from dotenv import load_dotenv
+from tenacity import retry, retry_if_exception_type, stop_after_attempt, wait_random_exponential
+
+# Optional: local language detection, used before asking the model
+try:
+    from langdetect.detector_factory import DetectorFactory, PROFILES_DIRECTORY
+    from langdetect.lang_detect_exception import LangDetectException
+except ImportError:
+    DetectorFactory = None
+
+TRANSLATION_MODEL = "google/gemma-3-27b-it-free"  # Using Gemma 3 27b it free model
+MAX_CONCURRENT_REQUESTS = 8  # Upper bound on in-flight OpenRouter calls to respect the rate limit
+REQUESTS_PER_MINUTE = 60
+
+# Token bucket shared by all OpenRouter calls, so requests are throttled
+# before the API starts rejecting them
+request_limiter = AsyncLimiter(REQUESTS_PER_MINUTE, 60)
+
+# Languages the assistant supports, as ISO 639-1 codes
+SUPPORTED_LANGUAGES = ("en", "hi", "ta", "te", "kn", "bn", "mr", "gu", "ml", "pa")
+_SUPPORTED_CODES = frozenset(SUPPORTED_LANGUAGES)
+_LANG_CODE_RE = re.compile(r"\b([a-z]{2})\b")
+LOCAL_DETECTION_CONFIDENCE = 0.9  # Below this, detection falls back to the model
+
+# Prefixes that mark the fallback output as "translated"
+MOCK_TRANSLATION_PREFIXES = {
+    "hi": "[हिंदी अनुवाद] ",
+    "ta": "[தமிழ் மொழிபெயர்ப்பு] ",
+    "te": "[తెలుగు అనువాదం] ",
+    "bn": "[বাংলা অনুবাদ] ",
+    "mr": "[मराठी अनुवाद] ",
+    "gu": "[ગુજરાતી અનુવાદ] ",
+    "kn": "[ಕನ್ನಡ ಅನುವಾದ] ",
+    "ml": "[മലയാളം വിവർത്തനം] ",
+    "pa": "[ਪੰਜਾਬੀ ਅਨੁਵਾਦ] ",
+}
+
+# Errors worth retrying; anything else falls back to the mock output straight away
+RETRYABLE_ERRORS = (openai.RateLimitError, openai.APITimeoutError, openai.APIConnectionError)
+
+def needs_translation(text, source_language, target_language):
+    """Tell whether text has to go to the model at all"""
+    if source_language == target_language:
+        return False
+    # Pure ASCII text is taken to be English already
+    return not (target_language == "en" and text.isascii())
+
+def _completed(result):
+    """Wrap an already known result in a finished Future"""
+    future = Future()
+    future.set_result(result)
+    return future
+
+def translation_messages(text, source_language, target_language):
+    """Build the chat messages for a translation request"""
+    prompt = f"Translate the following text from {source_language} to {target_language}. Only return the translated text, nothing else:\n\n{text}"
+    return [
+        {"role": "system", "content": "You are a helpful translation assistant."},
+        {"role": "user", "content": prompt}
+    ]
+
+@functools.lru_cache(maxsize=None)
+def _detector_factory():
+    """Load langdetect profiles for the supported languages only, on first use"""
+    profiles = []
+    for code in SUPPORTED_LANGUAGES:
+        with open(os.path.join(PROFILES_DIRECTORY, code), encoding="utf-8") as f:
+            profiles.append(f.read())
+    factory = DetectorFactory()
+    factory.load_json_profile(profiles)
+    factory.set_seed(0)
+    return factory
+
+def detect_language_locally(text):
+    """Return the language of text if langdetect is confident about it, else None"""
+    if DetectorFactory is None:
+        return None
+    try:
+        detector = _detector_factory().create()
+        detector.append(text)
+        best = detector.get_probabilities()[0]
+    except LangDetectException:
+        return None
+    return best.lang if best.prob > LOCAL_DETECTION_CONFIDENCE else None
 
 class OpenRouterTranslate:
     def __init__(self, api_key=None):
@@ -10,35 +101,121 @@ class OpenRouterTranslate:
         self.initialized = False
         
         if self.api_key:
+            # One pooled HTTP/2 client, so the TLS handshake is paid once and
+            # concurrent requests share kept-alive connections
+            self._http = httpx.AsyncClient(
+                http2=True,
+                limits=httpx.Limits(max_keepalive_connections=32, max_connections=64),
+                timeout=httpx.Timeout(connect=5, read=30, write=10, pool=5),
+            )
             # Configure the OpenAI client to use OpenRouter
-            self.client = openai.OpenAI(
+            self.client = openai.AsyncOpenAI(
                 base_url="https://openrouter.ai/api/v1",
-                api_key=self.api_key
+                api_key=self.api_key,
+                http_client=self._http
             )
+            # All API calls run on one background event loop, so independent
+            # requests overlap while callers keep a plain blocking interface
+            self._loop = asyncio.new_event_loop()
+            self._semaphore = asyncio.Semaphore(MAX_CONCURRENT_REQUESTS)
+            self._paused_until = 0.0
+            threading.Thread(target=self._loop.run_forever, name="openrouter-loop", daemon=True).start()
             self.initialized = True
+            atexit.register(self.close)
             print("OpenRouterTranslate initialized successfully")
         else:
             print("Warning: OpenRouter API key not provided")
+
+    def close(self):
+        """Close the HTTP connections and stop the background loop"""
+        if not self.initialized:
+            return
+        self.initialized = False
+        self._run(self._http.aclose())
+        self._loop.call_soon_threadsafe(self._loop.stop)
+
+    def _run(self, coro):
+        """Run a coroutine on the background loop and wait for its result"""
+        return asyncio.run_coroutine_threadsafe(coro, self._loop).result()
+
+    @retry(
+        wait=wait_random_exponential(min=0.25, max=8),
+        stop=stop_after_attempt(5),
+        retry=retry_if_exception_type(RETRYABLE_ERRORS),
+        reraise=True,
+    )
+    async def _complete(self, messages, **kwargs):
+        """Send one chat completion request, retrying transient failures with backoff"""
+        async with self._semaphore:
+            delay = self._paused_until - self._loop.time()
+            if delay > 0:
+                await asyncio.sleep(delay)
+            async with request_limiter:
+                try:
+                    raw = await self.client.chat.completions.with_raw_response.create(
+                        model=TRANSLATION_MODEL,
+                        messages=messages,
+                        temperature=0.3,  # Lower temperature for more accurate translations
+                        **kwargs
+                    )
+                except openai.RateLimitError as e:
+                    self._note_rate_limit(e.response.headers)
+                    raise
+            self._note_rate_limit(raw.headers)
+            return raw.parse()
+
+    def _note_rate_limit(self, headers):
+        """Hold back new requests when OpenRouter reports the rate limit as used up"""
+        retry_after = headers.get("retry-after")
+        remaining = headers.get("x-ratelimit-remaining-requests", headers.get("x-ratelimit-remaining"))
+        if retry_after is None and remaining != "0":
+            return
+        try:
+            delay = float(retry_after)
+        except (TypeError, ValueError):
+            delay = 1.0
+        self._paused_until = max(self._paused_until, self._loop.time() + delay)
     
     def translate(self, text, source_language, target_language):
         """Translate text using OpenRouter's Gemma model"""
+        source_language, target_language = source_language.lower(), target_language.lower()
+        if not needs_translation(text, source_language, target_language):
+            return text
+
         if not self.initialized:
             print("OpenRouterTranslate not initialized properly")
             return self._mock_translate(text, target_language)
-        
+
+        return self._run(self.translate_async(text, source_language, target_language))
+
+    def submit_translation(self, text, source_language, target_language):
+        """Start a translation in the background and return a Future for its result"""
+        source_language, target_language = source_language.lower(), target_language.lower()
+        if not needs_translation(text, source_language, target_language):
+            return _completed(text)
+        if not self.initialized:
+            return _completed(self._mock_translate(text, target_language))
+        return asyncio.run_coroutine_threadsafe(
+            self.translate_async(text, source_language, target_language), self._loop
+        )
+
+    async def translate_async(self, text, source_language, target_language):
+        """Translate text, sending each paragraph of a long text as a concurrent request"""
+        paragraphs = text.split("\n\n")
+        if len(paragraphs) == 1:
+            return await self._translate_one(text, source_language, target_language)
+
+        translated = await asyncio.gather(*[
+            self._translate_one(p, source_language, target_language) if p.strip() else asyncio.sleep(0, p)
+            for p in paragraphs
+        ])
+        return "\n\n".join(translated)
+
+    async def _translate_one(self, text, source_language, target_language):
+        """Translate a single piece of text with one API call"""
         try:
-            # Create a prompt for translation
-            prompt = f"Translate the following text from {source_language} to {target_language}. Only return the translated text, nothing else:\n\n{text}"
-            
             # Call OpenRouter API using OpenAI client
-            response = self.client.chat.completions.create(
-                model="google/gemma-3-27b-it-free",  # Using Gemma 3 27b it free model
-                messages=[
-                    {"role": "system", "content": "You are a helpful translation assistant."},
-                    {"role": "user", "content": prompt}
-                ],
-                temperature=0.3,  # Lower temperature for more accurate translations
-            )
+            response = await self._complete(translation_messages(text, source_language, target_language))
             
             # Extract the translated text from the response
             translated_text = response.choices[0].message.content.strip()
@@ -48,63 +225,47 @@ class OpenRouterTranslate:
             print(f"Translation error: {e}")
             # Fall back to mock translation if API call fails
             return self._mock_translate(text, target_language)
-    
+
     def _mock_translate(self, text, target_language):
         """Mock translation function as fallback"""
         print(f"Using mock translation for {target_language}: {text}")
         
         # For demonstration, we'll add a prefix to show it was "translated"
-        if target_language == "hi":
-            return f"[हिंदी अनुवाद] {text}"
-        elif target_language == "ta":
-            return f"[தமிழ் மொழிபெயர்ப்பு] {text}"
-        elif target_language == "te":
-            return f"[తెలుగు అనువాదం] {text}"
-        elif target_language == "bn":
-            return f"[বাংলা অনুবাদ] {text}"
-        elif target_language == "mr":
-            return f"[मराठी अनुवाद] {text}"
-        elif target_language == "gu":
-            return f"[ગુજરાતી અનુવાદ] {text}"
-        elif target_language == "kn":
-            return f"[ಕನ್ನಡ ಅನುವಾದ] {text}"
-        elif target_language == "ml":
-            return f"[മലയാളം വിവർത്തനം] {text}"
-        elif target_language == "pa":
-            return f"[ਪੰਜਾਬੀ ਅਨੁਵਾਦ] {text}"
-        else:
-            return text
+        return MOCK_TRANSLATION_PREFIXES.get(target_language, "") + text
     
     def detect_language(self, text):
         """Language detection"""
-        if not self.initialized:
+        if text.isascii():
             return "en"
-            
         try:
-            # Use OpenRouter to detect language
-            prompt = f"Detect the language of the following text and respond with only the ISO 639-1 language code (e.g., 'en', 'hi', 'ta'):\n\n{text}"
-            
-            response = self.client.chat.completions.create(
-                model="google/gemma-3-27b-it-free",
-                messages=[
-                    {"role": "system", "content": "You are a language detection assistant."},
-                    {"role": "user", "content": prompt}
-                ],
-                temperature=0.3,
-            )
-            
-            detected_lang = response.choices[0].message.content.strip().lower()
-            # Extract just the language code if there's additional text
-            if len(detected_lang) > 2:
-                for word in detected_lang.split():
-                    if len(word) == 2:
-                        detected_lang = word
-                        break
-                else:
-                    detected_lang = "en"  # Default to English if no valid code found
-            
-            return detected_lang
-            
+            # Only the start of the message matters for detection, which also
+            # lets repeated and near-identical messages share a cache entry
+            return self._detect_cached(text[:256].strip().lower())
         except Exception as e:
             print(f"Language detection error: {e}")
-            return "en"  # Default to English on error
\ No newline at end of file
+            return "en"  # Default to English on error
+
+    @functools.lru_cache(maxsize=4096)
+    def _detect_cached(self, sample):
+        # Errors propagate instead of returning "en", so they are not cached
+        detected_lang = detect_language_locally(sample)
+        if detected_lang:
+            return detected_lang
+        if not self.initialized:
+            return "en"
+        return self._run(self.detect_language_async(sample))
+
+    async def detect_language_async(self, text):
+        """Ask the model for the ISO 639-1 code of the text's language"""
+        # Use OpenRouter to detect language
+        prompt = f"Detect the language of the following text and respond with only the ISO 639-1 language code (e.g., 'en', 'hi', 'ta'):\n\n{text}"
+        
+        response = await self._complete([
+            {"role": "system", "content": "You are a language detection assistant."},
+            {"role": "user", "content": prompt}
+        ])
+        
+        # The model sometimes wraps the code in a sentence; take the first
+        # supported code it mentions, so stray words like "is" are ignored
+        codes = _LANG_CODE_RE.findall(response.choices[0].message.content.lower())
+        return next((code for code in codes if code in _SUPPORTED_CODES), "en")
@@ -5,50 +5,53 @@ AI-Powered Local Governance Assistant - Fully Integrated Backend
 """
 
 import os
+import re
+import atexit
 import uuid
 import json
+import hashlib
+import hmac
 import traceback
 import sqlite3
-import random
-import string
 import base64
-import io
+import secrets
+import shutil
+import time
+import queue
+import threading
+import contextlib
+import functools
+import itertools
+import collections
 from datetime import datetime
 from typing import Optional, Dict
 
-from flask import Flask, request, jsonify, send_from_directory, send_file, render_template
+from flask import Flask, Response, g, request, jsonify, send_from_directory, render_template, stream_with_context
+from flask.json.provider import JSONProvider
 from flask_cors import CORS
+from werkzeug.exceptions import NotFound, RequestEntityTooLarge
+from werkzeug.utils import secure_filename
 from dotenv import load_dotenv
+from cachetools import TTLCache
+import orjson
 
-# -------- Optional: Google Gemini --------
-GEMINI_AVAILABLE = True
-try:
-    import google.generativeai as genai
-except ImportError:
-    GEMINI_AVAILABLE = False
-
-# -------- Voice packages --------
-try:
-    import speech_recognition as sr
-except ImportError:
-    sr = None
-try:
-    from gtts import gTTS
-except ImportError:
-    gTTS = None
-
-# -------- Translation via OpenRouter --------
-OpenRouterTranslate = None
-try:
-    # Corrected the import to handle the typo in the filename
-    from OpenRouterTranslate import OpenRouterTranslate as ORT
-    OpenRouterTranslate = ORT
-except ImportError:
-    try:
-        from OpentRouterTanslate import OpenRouterTranslate as ORT
-        OpenRouterTranslate = ORT
-    except ImportError:
-        OpenRouterTranslate = None
+# Gemini, faster-whisper, gTTS and the OpenRouter client are heavy imports
+# (grpc/protobuf, CTranslate2, openai/httpx) that only some endpoints need,
+# so each is imported by its get_* loader (below) the first time it is used
+# rather than at startup
+def load_once(loader):
+    """Decorator: runs a zero-argument loader on its first call only and returns that result from then on."""
+    lock = threading.Lock()
+    result = []
+
+    @functools.wraps(loader)
+    def wrapper():
+        if not result:
+            with lock:
+                if not result:
+                    result.append(loader())
+        return result[0]
+    return wrapper
 
 # -------------------- Flask App Setup --------------------
 BASE_DIR = os.path.dirname(os.path.abspath(__file__))
@@ -61,17 +64,132 @@ os.makedirs(TTS_DIR, exist_ok=True)
 
 load_dotenv()
 
+class OrjsonProvider(JSONProvider):
+    """JSON provider backed by orjson, which writes UTF-8 text without escaping it."""
+    def dumps(self, obj, **kwargs):
+        return orjson.dumps(obj, option=orjson.OPT_NON_STR_KEYS).decode()
+
+    def loads(self, s, **kwargs):
+        return orjson.loads(s)
+
+class ORJSONResponse(Response):
+    """A response for a body that orjson has already encoded."""
+    default_mimetype = "application/json"
+
+def fast_jsonify(obj):
+    """
+    jsonify() for the hot endpoints: orjson's bytes become the body as-is,
+    skipping the provider's decode to str and Flask's re-encode.
+    """
+    return ORJSONResponse(orjson.dumps(obj, option=orjson.OPT_NON_STR_KEYS))
+
 app = Flask(__name__)
 app.config["SECRET_KEY"] = os.environ.get("FLASK_SECRET_KEY", "dev-secret")
-app.config["JSON_AS_ASCII"] = False
+app.json = OrjsonProvider(app)
+# Behind a front-end server that understands X-Sendfile (Apache mod_xsendfile,
+# lighttpd), let it send files from disk instead of streaming them through Python
+app.config["USE_X_SENDFILE"] = os.environ.get("USE_X_SENDFILE", "").lower() in ("1", "true", "yes")
+# Werkzeug rejects larger request bodies before any of it is read
+app.config["MAX_CONTENT_LENGTH"] = int(os.environ.get("MAX_UPLOAD_MB", "10")) * 1024 * 1024
 CORS(app, resources={r"/api/*": {"origins": "*"}})
 
+@app.errorhandler(RequestEntityTooLarge)
+def request_too_large(e):
+    limit_mb = app.config["MAX_CONTENT_LENGTH"] // (1024 * 1024)
+    return jsonify({"ok": False, "error": f"File is too large (maximum {limit_mb} MB)"}), 413
+
 # -------------------- DB Helpers --------------------
+class ConnectionPool:
+    """
+    A small pool of long-lived SQLite connections. Reusing connections keeps
+    their page cache and prepared statements warm across requests, and the
+    LIFO order hands out the most recently used (warmest) one first.
+    """
+    def __init__(self, path, size=8, optimize_every=100):
+        self.path = path
+        self._idle = queue.LifoQueue(maxsize=size)
+        self._optimize_every = optimize_every
+        self._releases = itertools.count(1)
+
+    def _connect(self):
+        conn = sqlite3.connect(self.path, check_same_thread=False, isolation_level=None)
+        conn.row_factory = sqlite3.Row
+        # Tuned once per connection, which with pooling means once per
+        # connection lifetime rather than per request: WAL lets readers run
+        # alongside a writer, a 64 MB page cache and mmap'd reads avoid most
+        # pread() calls, and writers wait up to 5 s for a lock instead of failing
+        conn.executescript("""
+            PRAGMA journal_mode=WAL;
+            PRAGMA synchronous=NORMAL;
+            PRAGMA temp_store=MEMORY;
+            PRAGMA cache_size=-64000;
+            PRAGMA mmap_size=268435456;
+            PRAGMA busy_timeout=5000;
+        """)
+        return conn
+
+    def close_idle(self):
+        """Closes every idle connection. Called before fork(), which SQLite connections must not cross."""
+        while True:
+            try:
+                conn = self._idle.get_nowait()
+            except queue.Empty:
+                return
+            conn.close()
+
+    def reset(self):
+        """
+        Gives a forked child a fresh, empty queue, in case another thread
+        held the old one's lock at the moment of the fork. The parent's
+        idle connections were already closed by close_idle().
+        """
+        self._idle = queue.LifoQueue(maxsize=self._idle.maxsize)
+
+    def get(self):
+        """Takes an idle connection, opening a new one if none is available."""
+        try:
+            return self._idle.get_nowait()
+        except queue.Empty:
+            return self._connect()
+
+    def release(self, conn):
+        """Returns a connection to the pool, closing it if the pool is full."""
+        if conn.in_transaction:
+            conn.rollback()
+        # Every Nth return, let SQLite re-analyze tables whose statistics have
+        # drifted (e.g. after many application inserts); a no-op when they are
+        # fresh. Releases happen before the response body is sent, so the
+        # pragma is handed to the background writer rather than run here
+        if next(self._releases) % self._optimize_every == 0:
+            queue_maintenance("PRAGMA optimize")
+        try:
+            self._idle.put_nowait(conn)
+        except queue.Full:
+            conn.close()
+
+    @contextlib.contextmanager
+    def acquire(self):
+        """Borrows a connection for the duration of a with-block."""
+        conn = self.get()
+        try:
+            yield conn
+        finally:
+            self.release(conn)
+
+db_pool = ConnectionPool(DB_PATH)
+
 def get_db():
-    """Establishes a connection to the SQLite database."""
-    conn = sqlite3.connect(DB_PATH, check_same_thread=False)
-    conn.row_factory = sqlite3.Row
-    return conn
+    """Returns the pooled SQLite connection for the current app context."""
+    if "db" not in g:
+        g.db = db_pool.get()
+    return g.db
+
+@app.teardown_appcontext
+def release_db(exception):
+    """Hands the context's connection back to the pool (without closing it)."""
+    conn = g.pop("db", None)
+    if conn is not None:
+        db_pool.release(conn)
 
 def init_db():
     """
@@ -104,58 +222,577 @@ def init_db():
             created_at TIMESTAMP DEFAULT CURRENT_TIMESTAMP
         )
     """)
-    conn.commit()
-    conn.close()
+    # Gemini answers, looked up by AnswerCache
+    cur.execute("""
+        CREATE TABLE IF NOT EXISTS chat_cache (
+            key BLOB PRIMARY KEY,
+            scope TEXT,
+            question TEXT,
+            answer TEXT,
+            embedding BLOB,
+            created_at TIMESTAMP DEFAULT CURRENT_TIMESTAMP
+        )
+    """)
+    # Indexes: a session's history in order, and complaints by status, newest first
+    cur.executescript("""
+        CREATE INDEX IF NOT EXISTS idx_chat_session ON chat_history(session_id, id);
+        CREATE INDEX IF NOT EXISTS idx_complaints_status ON complaints(status, created_at DESC);
+        CREATE INDEX IF NOT EXISTS idx_chat_cache_scope ON chat_cache(scope, created_at);
+    """)
+    # The applications table itself belongs to setup_applications.py, but
+    # databases set up before its saved-files index existed need it too.
+    # The id column makes it match the saved-files page order exactly;
+    # the older two-column index is replaced
+    try:
+        cur.executescript("""
+            DROP INDEX IF EXISTS idx_apps_email_date;
+            CREATE INDEX IF NOT EXISTS idx_apps_email_date_id
+            ON applications(email, submission_date DESC, id DESC)
+            WHERE file_path IS NOT NULL;
+        """)
+    except sqlite3.OperationalError as e:
+        print(f"[WARN] Could not index applications (run setup_applications.py): {e}")
+    # Let SQLite refresh planner statistics where they are out of date
+    cur.execute("PRAGMA optimize")
+
+# Inserts that a response does not depend on (chat turns, cached answers)
+# are written by a background thread so requests never wait on them, and
+# writes arriving close together share one transaction and fsync
+SQL_INSERT_CHAT = """
+    INSERT INTO chat_history (session_id, user_message, bot_message, source_lang, target_lang)
+    VALUES (?, ?, ?, ?, ?)
+"""
+WRITE_FLUSH_INTERVAL = 0.1  # seconds
+WRITE_BATCH_SIZE = 64
+WRITE_QUEUE_SIZE = 10000
+_write_queue = queue.Queue(maxsize=WRITE_QUEUE_SIZE)
+
+def _db_writer():
+    """
+    Collects queued (sql, params) writes for up to WRITE_FLUSH_INTERVAL (or
+    until WRITE_BATCH_SIZE rows) and commits them in one transaction, with
+    one executemany per run of the same statement. A failing statement only
+    loses its own run. Statements queued without params (maintenance such as
+    PRAGMA optimize) run once each, after the commit. A None in the queue
+    tells the writer to flush and stop.
+    """
+    while True:
+        writes = [_write_queue.get()]
+        deadline = time.monotonic() + WRITE_FLUSH_INTERVAL
+        while writes[-1] is not None and len(writes) < WRITE_BATCH_SIZE:
+            timeout = deadline - time.monotonic()
+            if timeout <= 0:
+                break
+            try:
+                writes.append(_write_queue.get(timeout=timeout))
+            except queue.Empty:
+                break
+        stopping = writes[-1] is None
+        writes = [write for write in writes if write is not None]
+        maintenance = dict.fromkeys(sql for sql, params in writes if params is None)
+        writes = [write for write in writes if write[1] is not None]
+        if writes or maintenance:
+            with db_pool.acquire() as conn:
+                if writes:
+                    try:
+                        conn.execute("BEGIN")
+                        for sql, group in itertools.groupby(writes, key=lambda write: write[0]):
+                            conn.execute("SAVEPOINT batch")
+                            try:
+                                conn.executemany(sql, [params for _, params in group])
+                                conn.execute("RELEASE batch")
+                            except sqlite3.Error as e:
+                                conn.execute("ROLLBACK TO batch")
+                                conn.execute("RELEASE batch")
+                                print(f"Database error on background write: {e}")
+                        conn.execute("COMMIT")
+                    except sqlite3.Error as e:
+                        print(f"Database error on background write: {e}")
+                for sql in maintenance:
+                    try:
+                        conn.execute(sql)
+                    except sqlite3.Error as e:
+                        print(f"Database error on {sql}: {e}")
+        if stopping:
+            return
+
+def _start_db_writer():
+    global _db_writer_thread
+    _db_writer_thread = threading.Thread(target=_db_writer, name="db-writer", daemon=True)
+    _db_writer_thread.start()
+
+_start_db_writer()
+
+@atexit.register
+def _stop_db_writer():
+    """Writes anything still queued before the process exits."""
+    _write_queue.put(None)
+    _db_writer_thread.join(timeout=5)
+
+def queue_write(sql, params=None):
+    """Queues one INSERT/UPDATE for the background writer, or a maintenance statement if there are no params."""
+    try:
+        _write_queue.put_nowait((sql, params))
+    except queue.Full:
+        # The writer has fallen far behind; wait for room rather than drop the row
+        _write_queue.put((sql, params))
+
+def queue_maintenance(sql):
+    """
+    Queues a maintenance statement for the background writer, dropping it if
+    the queue is full. It is only worth running when the writer keeps up, and
+    the writer itself must never wait on its own queue.
+    """
+    try:
+        _write_queue.put_nowait((sql, None))
+    except queue.Full:
+        pass
+
+def save_chat(session_id, user_message, bot_message, source_lang, target_lang):
+    """Queues one chat turn to be stored in the chat_history table."""
+    queue_write(SQL_INSERT_CHAT, (session_id, user_message, bot_message, source_lang, target_lang))
 
 # Initialize the necessary tables on startup
-init_db()
+with app.app_context():
+    init_db()
+
+def _after_fork_in_child():
+    """
+    gunicorn --preload imports this module once and forks the workers from
+    it. Threads do not survive fork() and SQLite connections must not cross
+    it (the master closes its idle ones just before forking), so each worker
+    starts its own background writer and opens its own connections.
+    """
+    global _write_queue
+    db_pool.reset()
+    _write_queue = queue.Queue(maxsize=WRITE_QUEUE_SIZE)
+    _start_db_writer()
+
+os.register_at_fork(before=db_pool.close_idle, after_in_child=_after_fork_in_child)
 
 # -------------------- Gemini Setup --------------------
-gemini_model = None
-def init_gemini():
-    """Initializes the Google Gemini model if the API key is available."""
-    global gemini_model
-    if not GEMINI_AVAILABLE:
+@load_once
+def get_gemini_model():
+    """Initializes the Google Gemini model on first use, if the API key is available."""
+    try:
+        import google.generativeai as genai
+    except ImportError:
         print("[WARN] google-generativeai not installed.")
-        return
+        return None
     api_key = os.environ.get("GEMINI_API_KEY")
     if not api_key:
         print("[WARN] GEMINI_API_KEY not found in .env file.")
-        return
+        return None
     try:
         genai.configure(api_key=api_key)
-        gemini_model = genai.GenerativeModel("gemini-1.5-flash")
+        model = genai.GenerativeModel("gemini-1.5-flash")
         print("[OK] Gemini initialized.")
+        return model
     except Exception as e:
         print(f"[ERROR] Gemini init failed: {e}")
+        return None
+
+# -------------------- Speech-to-Text Setup --------------------
+@load_once
+def get_whisper_model():
+    """Loads the local Whisper model (int8 on CPU) on first use, if faster-whisper is installed."""
+    try:
+        from faster_whisper import WhisperModel
+    except ImportError:
+        print("[WARN] faster-whisper not installed.")
+        return None
+    try:
+        model = WhisperModel(os.environ.get("WHISPER_MODEL", "small"), device="cpu", compute_type="int8")
+        print("[OK] Whisper initialized.")
+        return model
+    except Exception as e:
+        print(f"[ERROR] Whisper init failed: {e}")
+        return None
 
-init_gemini()
+# -------------------- Text-to-Speech Setup --------------------
+@load_once
+def get_gtts():
+    """Returns the gTTS class, or None if gTTS is not installed."""
+    try:
+        from gtts import gTTS
+    except ImportError:
+        print("[WARN] gTTS not installed.")
+        return None
+    return gTTS
 
 # -------------------- Translator Setup --------------------
-translator = None
-if OpenRouterTranslate:
+@load_once
+def get_translator():
+    """Creates the OpenRouter translator on first use."""
+    try:
+        # Corrected the import to handle the typo in the filename
+        from OpenRouterTranslate import OpenRouterTranslate
+    except ImportError:
+        try:
+            from OpentRouterTanslate import OpenRouterTranslate
+        except ImportError:
+            return None
     try:
         translator = OpenRouterTranslate()
         print("[OK] OpenRouterTranslate initialized.")
+        return translator
     except Exception as e:
         print(f"[ERROR] OpenRouterTranslate init failed: {e}")
+        return None
 
 # -------------------- Utility Functions --------------------
 def generate_ticket(length=8):
-    """Generates a random, unique alphanumeric ticket number."""
-    characters = string.ascii_uppercase + string.digits
-    return ''.join(random.choice(characters) for i in range(length))
+    """Generates a random alphanumeric ticket number from the OS CSPRNG."""
+    return secrets.token_urlsafe(length).upper().replace("_", "A").replace("-", "B")[:length]
+
+GEMINI_UNAVAILABLE_MSG = "Chatbot is currently unavailable. Please try again later."
+GEMINI_ERROR_MSG = "I'm having trouble connecting to my knowledge base right now. Please try again later."
 
-def ask_gemini(question):
-    """Interacts with the Gemini model to get a response."""
+# Prompts with an email address, a +91 number or a long digit run (phone,
+# Aadhaar, application numbers) are specific to one user and never cached
+PERSONAL_DATA_RE = re.compile(r"\S+@\S+\.\w+|\+91|\d{6,}")
+# Questions whose embeddings are at least this similar share an answer
+SEMANTIC_CACHE_THRESHOLD = 0.92
+# Newest cached answers held in the in-memory similarity index
+SEMANTIC_CACHE_SIZE = 5000
+# Persisted answers older than this are neither served nor loaded
+CHAT_CACHE_MAX_AGE = "-7 days"
+SQL_CACHE_LOOKUP = "SELECT answer FROM chat_cache WHERE key = ? AND created_at > datetime('now', ?)"
+SQL_CACHE_STORE = """
+    INSERT OR REPLACE INTO chat_cache (key, scope, question, answer, embedding)
+    VALUES (?, ?, ?, ?, ?)
+"""
+SQL_CACHE_LOAD_SCOPE = """
+    SELECT answer, embedding FROM chat_cache
+    WHERE scope = ? AND embedding IS NOT NULL AND created_at > datetime('now', ?)
+    ORDER BY created_at DESC LIMIT ?
+"""
+EMBEDDING_MODEL = os.environ.get("EMBEDDING_MODEL", "paraphrase-multilingual-MiniLM-L12-v2")
+
+@load_once
+def get_embedder():
+    """Loads the sentence-transformers model for the semantic answer cache, if installed."""
+    try:
+        from sentence_transformers import SentenceTransformer
+    except ImportError:
+        print("[WARN] sentence-transformers not installed, semantic chat cache disabled.")
+        return None
+    try:
+        model = SentenceTransformer(EMBEDDING_MODEL, device="cpu")
+        print("[OK] Embedding model initialized.")
+        return model
+    except Exception as e:
+        print(f"[ERROR] Embedding model init failed: {e}")
+        return None
+
+def normalize_question(text):
+    """Lowercases a question and collapses its whitespace, so trivially different spellings share a cache entry."""
+    return " ".join(text.lower().split())
+
+class AnswerCache:
+    """
+    Two-tier cache of Gemini answers, persisted in the chat_cache table.
+
+    The exact tier maps a normalized question to its answer. The semantic
+    tier (only when sentence-transformers is installed) embeds the question
+    and returns the answer to the closest earlier question, if its cosine
+    similarity reaches SEMANTIC_CACHE_THRESHOLD. Entries are grouped by
+    scope, since the same question gets a different answer in another
+    reply language. Callers turn the semantic tier off when the reply
+    language is not fixed by the scope, since the multilingual embeddings
+    place a question close to its translations.
+    """
+    def __init__(self, maxsize=4096, ttl=3600):
+        self._exact = TTLCache(maxsize=maxsize, ttl=ttl)
+        self._lock = threading.Lock()
+        # scope -> semantic_index.SemanticIndex, loaded on first use
+        self._index = {}
+
+    @staticmethod
+    def key(question, scope):
+        return hashlib.blake2b(f"{scope}\0{question}".encode("utf-8"), digest_size=16).digest()
+
+    def get(self, question, scope, semantic=True):
+        """
+        Looks up a normalized question. Returns the cached answer (or None)
+        and the question's embedding if one was computed, to pass on to put().
+        """
+        key = self.key(question, scope)
+        with self._lock:
+            answer = self._exact.get(key)
+        if answer:
+            return answer, None
+        with db_pool.acquire() as conn:
+            row = conn.execute(SQL_CACHE_LOOKUP, (key, CHAT_CACHE_MAX_AGE)).fetchone()
+        embedding = None
+        if row:
+            answer = row["answer"]
+        elif semantic:
+            embedding = self._embed(question)
+            if embedding is not None:
+                answer = self._similar(embedding, scope)
+        if answer:
+            with self._lock:
+                self._exact[key] = answer
+        return answer, embedding
+
+    def put(self, question, scope, answer, embedding=None, semantic=True):
+        """Caches the answer to a normalized question, reusing the embedding from get() if there is one."""
+        key = self.key(question, scope)
+        if embedding is None and semantic:
+            embedding = self._embed(question)
+        with self._lock:
+            self._exact[key] = answer
+            if embedding is not None and scope in self._index:
+                self._index[scope].add(answer, embedding)
+        queue_write(SQL_CACHE_STORE, (key, scope, question, answer,
+                                      None if embedding is None else embedding.tobytes()))
+
+    def _embed(self, question):
+        embedder = get_embedder()
+        if embedder is None:
+            return None
+        return embedder.encode(question, normalize_embeddings=True).astype("float32")
+
+    def _load_index(self, scope, dimensions):
+        import numpy as np
+        from semantic_index import SemanticIndex
+        with db_pool.acquire() as conn:
+            rows = conn.execute(SQL_CACHE_LOAD_SCOPE, (scope, CHAT_CACHE_MAX_AGE, SEMANTIC_CACHE_SIZE)).fetchall()
+        # Rows embedded by a different model (another vector size) are skipped
+        rows = [row for row in reversed(rows) if len(row["embedding"]) == dimensions * 4]
+        index = SemanticIndex(dimensions, SEMANTIC_CACHE_SIZE, SEMANTIC_CACHE_THRESHOLD, capacity=max(64, len(rows)))
+        for row in rows:
+            index.add(row["answer"], np.frombuffer(row["embedding"], dtype=np.float32))
+        return index
+
+    def _similar(self, embedding, scope):
+        with self._lock:
+            index = self._index.get(scope)
+        if index is None:
+            # Loaded without the lock, so other scopes are not held up by the
+            # query; if two requests race, the first index stored is kept
+            loaded = self._load_index(scope, embedding.shape[0])
+            with self._lock:
+                index = self._index.setdefault(scope, loaded)
+        with self._lock:
+            return index.closest(embedding)
+
+answer_cache = AnswerCache()
+
+def cache_question(question):
+    """Returns the normalized question to cache an answer under, or None if it must not be cached."""
+    if PERSONAL_DATA_RE.search(question):
+        return None
+    return normalize_question(question)
+
+# A conversation's earlier turns are read back from chat_history, so a
+# follow-up is answered in context whichever worker process receives it
+CHAT_SESSION_MAX_TURNS = 10
+SESSION_ID_MAX_LENGTH = 64
+SQL_CHAT_HISTORY = """
+    SELECT user_message, bot_message FROM chat_history
+    WHERE session_id = ?
+    ORDER BY id DESC LIMIT ?
+"""
+
+def issue_session_id():
+    """Returns a new session id, signed so that only ids issued here are accepted back."""
+    token = uuid.uuid4().hex
+    signature = hmac.new(app.config["SECRET_KEY"].encode(), token.encode(), hashlib.sha256).hexdigest()[:16]
+    return f"{token}.{signature}"
+
+def is_issued_session_id(session_id):
+    """Checks a client-supplied session id against its signature."""
+    token, _, signature = session_id.partition(".")
+    expected = hmac.new(app.config["SECRET_KEY"].encode(), token.encode(), hashlib.sha256).hexdigest()[:16]
+    # Compared as bytes: compare_digest rejects str holding non-ASCII characters
+    return hmac.compare_digest(signature.encode(), expected.encode())
+
+def load_chat_history(session_id):
+    """
+    Returns the session's last CHAT_SESSION_MAX_TURNS answered turns, oldest
+    first, in the form ChatSession takes. Turns are stored by the background
+    writer, so one sent within WRITE_FLUSH_INTERVAL of the previous reply
+    may not see it yet.
+    """
+    cursor = get_db().cursor()
+    cursor.execute(SQL_CHAT_HISTORY, (session_id, CHAT_SESSION_MAX_TURNS))
+    history = []
+    for row in reversed(cursor.fetchall()):
+        if not row["bot_message"] or row["bot_message"] in (GEMINI_UNAVAILABLE_MSG, GEMINI_ERROR_MSG):
+            continue
+        history.append({"role": "user", "parts": [row["user_message"]]})
+        history.append({"role": "model", "parts": [row["bot_message"]]})
+    return history
+
+def ask_gemini(prompt, question=None, scope="", history=None, semantic=True):
+    """
+    Interacts with the Gemini model to get a response. The answer is cached
+    under question (the user's own text, defaulting to the prompt) and scope;
+    semantic=False limits the cache to exact matches. With a history the
+    prompt is sent as the next turn of that conversation.
+    """
+    gemini_model = get_gemini_model()
     if not gemini_model:
-        return "Chatbot is currently unavailable. Please try again later."
+        return GEMINI_UNAVAILABLE_MSG
+    # A follow-up depends on the conversation so far, so only the opening
+    # question of a conversation is looked up or cached
+    question = None if history else cache_question(question or prompt)
+    if question:
+        cached, embedding = answer_cache.get(question, scope, semantic)
+        if cached:
+            return cached
+    try:
+        if history:
+            response = gemini_model.start_chat(history=history).send_message(prompt)
+        else:
+            response = gemini_model.generate_content(prompt)
+        answer = response.text
+    except Exception as e:
+        print(f"Gemini API Error: {e}")
+        return GEMINI_ERROR_MSG
+    if question:
+        answer_cache.put(question, scope, answer, embedding, semantic)
+    return answer
+
+def ask_gemini_stream(prompt, question=None, scope="", history=None, semantic=True):
+    """Yields the Gemini response piece by piece as it is generated."""
+    gemini_model = get_gemini_model()
+    if not gemini_model:
+        yield GEMINI_UNAVAILABLE_MSG
+        return
+    question = None if history else cache_question(question or prompt)
+    if question:
+        cached, embedding = answer_cache.get(question, scope, semantic)
+        if cached:
+            yield cached
+            return
+    parts = []
     try:
-        response = gemini_model.generate_content(question)
-        return response.text
+        if history:
+            stream = gemini_model.start_chat(history=history).send_message(prompt, stream=True)
+        else:
+            stream = gemini_model.generate_content(prompt, stream=True)
+        for chunk in stream:
+            if chunk.text:
+                parts.append(chunk.text)
+                yield chunk.text
     except Exception as e:
         print(f"Gemini API Error: {e}")
-        return "I'm having trouble connecting to my knowledge base right now. Please try again later."
+        if not parts:
+            yield GEMINI_ERROR_MSG
+        return
+    # Only complete answers are cached
+    if question and parts:
+        answer_cache.put(question, scope, "".join(parts), embedding, semantic)
+
+LANGUAGE_NAMES = {
+    "en": "English", "hi": "Hindi", "ta": "Tamil", "te": "Telugu", "kn": "Kannada",
+    "bn": "Bengali", "mr": "Marathi", "gu": "Gujarati", "ml": "Malayalam", "pa": "Punjabi",
+}
+
+def build_chat_prompt(message, source_language, target_language):
+    """
+    Builds a prompt that has Gemini answer in the user's language directly,
+    instead of translating the question and the answer separately.
+    """
+    asked_in = f" The question is in {LANGUAGE_NAMES.get(source_language, source_language)}." if source_language else ""
+    if target_language:
+        reply_in = f"Reply concisely in {LANGUAGE_NAMES.get(target_language, target_language)}."
+    else:
+        reply_in = "Reply concisely in the same language as the question."
+    return f"Answer the following question from a citizen about Indian local governance.{asked_in} {reply_in}\n\n{message}"
+
+def translate_text(text, source_language, target_language):
+    """Translates text, skipping the API call when no translation is needed."""
+    if source_language == target_language:
+        return text
+    translator = get_translator()
+    if not translator:
+        return text
+    return translator.translate(text, source_language, target_language)
+
+# Whitespace after sentence-ending punctuation (including the Devanagari danda) or a line break
+SENTENCE_BREAK_RE = re.compile(r"(?<=[.!?\u0964])\s+|\n+")
+
+def split_sentences(buffer):
+    """
+    Splits the complete sentences off a buffer of streamed text.
+    Returns a list of (sentence, separator) pairs and the unfinished remainder.
+    """
+    sentences, start = [], 0
+    for match in SENTENCE_BREAK_RE.finditer(buffer):
+        sentences.append((buffer[start:match.start()], match.group()))
+        start = match.end()
+    return sentences, buffer[start:]
+
+# Accepted application documents, by extension and the bytes they start with
+ALLOWED_DOCUMENTS = {
+    ".pdf": (b"%PDF-",),
+    ".jpg": (b"\xff\xd8\xff",),
+    ".jpeg": (b"\xff\xd8\xff",),
+    ".png": (b"\x89PNG\r\n\x1a\n",),
+}
+COPY_CHUNK_SIZE = 1 << 20  # 1 MB
+# Fresh ticket numbers tried before giving up on an application insert
+TICKET_ATTEMPTS = 3
+
+def is_allowed_document(uploaded_file):
+    """Checks an upload's extension and leading bytes against ALLOWED_DOCUMENTS, without reading the rest."""
+    signatures = ALLOWED_DOCUMENTS.get(os.path.splitext(uploaded_file.filename)[1].lower())
+    if not signatures:
+        return False
+    head = uploaded_file.stream.read(8)
+    uploaded_file.stream.seek(0)
+    return head.startswith(signatures)
+
+def make_etag(*parts):
+    """Builds an ETag from values that change whenever a response would."""
+    return hashlib.blake2b(":".join(map(str, parts)).encode("utf-8"), digest_size=8).hexdigest()
+
+def not_modified(etag):
+    """An empty 304 response for a client whose cached copy is current."""
+    response = Response(status=304)
+    response.set_etag(etag)
+    return response
+
+def sse_event(payload):
+    """Formats a payload as a server-sent event frame."""
+    return f"data: {orjson.dumps(payload).decode()}\n\n"
+
+# -------------------- SQL --------------------
+# Route queries live in constants so every request passes the identical
+# string, which each pooled connection's statement cache keys on
+SQL_SERVICES_ALL = "SELECT service_id, title, details FROM services"
+SQL_SERVICE_IDS = "SELECT service_id FROM services"
+SQL_INSERT_APP = """
+    INSERT INTO applications (service_id, name, email, phone, purpose, ticket_number, file_name, file_path)
+    VALUES (?, ?, ?, ?, ?, ?, ?, ?)
+    ON CONFLICT(ticket_number) DO NOTHING
+    RETURNING id
+"""
+SQL_SET_FILE_SIZE = "UPDATE applications SET file_size = ? WHERE id = ?"
+SQL_SAVED_VERSION_BY_EMAIL = """
+    SELECT COUNT(*), MAX(id) FROM applications
+    WHERE file_path IS NOT NULL AND email = ?
+"""
+SQL_SAVED_VERSION_ALL = "SELECT COUNT(*), MAX(id) FROM applications WHERE file_path IS NOT NULL"
+# Saved files are paged newest first by (submission_date, id); the _AFTER
+# variants continue from the last row of the previous page (keyset paging)
+_SQL_SAVED = """
+    SELECT id, service_id, name, email, ticket_number, file_name, submission_date
+    FROM applications
+    WHERE file_path IS NOT NULL"""
+_SQL_SAVED_AFTER = " AND (submission_date, id) < (?, ?)"
+_SQL_SAVED_ORDER = " ORDER BY submission_date DESC, id DESC LIMIT ?"
+SQL_SAVED_ALL = _SQL_SAVED + _SQL_SAVED_ORDER
+SQL_SAVED_ALL_AFTER = _SQL_SAVED + _SQL_SAVED_AFTER + _SQL_SAVED_ORDER
+SQL_SAVED_BY_EMAIL = _SQL_SAVED + " AND email = ?" + _SQL_SAVED_ORDER
+SQL_SAVED_BY_EMAIL_AFTER = _SQL_SAVED + " AND email = ?" + _SQL_SAVED_AFTER + _SQL_SAVED_ORDER
+SAVED_FILES_PAGE_SIZE = 50
+SAVED_FILES_MAX_PAGE_SIZE = 200
+SQL_DOWNLOAD = "SELECT file_name, file_path FROM applications WHERE id = ?"
 
 # -------------------- Routes --------------------
 
@@ -167,19 +804,57 @@ def index():
 def apply():
     return render_template("apply.html")
 
+# The services table is seeded by populate_services.py and read-only at
+# runtime, so its JSON and its set of ids are built once; bump
+# services_version after any write to it to rebuild the cached copies
+services_version = 0
+
+def invalidate_services_cache():
+    global services_version
+    services_version += 1
+
+# An empty services table raises LookupError rather than returning, so that
+# lru_cache does not keep the empty result once populate_services.py has run
+SERVICES_EMPTY_MSG = "services table is empty; run populate_services.py"
+
+@functools.lru_cache(maxsize=1)
+def services_payload(version):
+    """Returns the serialized services list and its ETag for a services_version."""
+    cursor = get_db().cursor()
+    cursor.execute(SQL_SERVICES_ALL)
+    rows = cursor.fetchall()
+    if not rows:
+        raise LookupError(SERVICES_EMPTY_MSG)
+    body = orjson.dumps([dict(row) for row in rows])
+    return body, hashlib.sha1(body).hexdigest()
+
+@functools.lru_cache(maxsize=1)
+def valid_service_ids(version):
+    """Returns the set of service ids for a services_version, checked by api_apply."""
+    cursor = get_db().cursor()
+    cursor.execute(SQL_SERVICE_IDS)
+    service_ids = frozenset(row["service_id"] for row in cursor.fetchall())
+    if not service_ids:
+        raise LookupError(SERVICES_EMPTY_MSG)
+    return service_ids
+
 @app.route("/api/services")
 def api_services():
-    conn = get_db()
-    cursor = conn.cursor()
     try:
-        cursor.execute("SELECT service_id, title, details FROM services")
-        services = cursor.fetchall()
-        return jsonify([dict(row) for row in services])
+        body, etag = services_payload(services_version)
+    except LookupError as e:
+        print(f"[WARN] {e}")
+        return jsonify({"ok": False, "error": "Services are not available yet"}), 503
     except sqlite3.Error as e:
         print(f"Database error on services query: {e}")
         return jsonify({"ok": False, "error": "Could not retrieve services"}), 500
-    finally:
-        conn.close()
+
+    if request.if_none_match.contains(etag):
+        return not_modified(etag)
+    response = ORJSONResponse(body)
+    response.set_etag(etag)
+    response.headers["Cache-Control"] = "public, max-age=300"
+    return response
 
 @app.route("/api/apply", methods=["POST"])
 def api_apply():
@@ -194,60 +869,104 @@ def api_apply():
     if not all([service_id, name, email, purpose]):
         return jsonify({"ok": False, "error": "Missing required fields"}), 400
 
-    conn = get_db()
-    cursor = conn.cursor()
-
     # Check if service_id is valid
-    cursor.execute("SELECT 1 FROM services WHERE service_id = ?", (service_id,))
-    if cursor.fetchone() is None:
-        conn.close()
+    try:
+        service_ids = valid_service_ids(services_version)
+    except LookupError as e:
+        print(f"[WARN] {e}")
+        return jsonify({"ok": False, "error": "Services are not available yet"}), 503
+    if service_id not in service_ids:
         return jsonify({"ok": False, "error": f"Service ID '{service_id}' is invalid."}), 404
 
-    file_name = uploaded_file.filename if uploaded_file else None
-    file_data = uploaded_file.read() if uploaded_file else None
-
-    ticket_number = generate_ticket()
+    has_file = bool(uploaded_file and uploaded_file.filename)
+    if has_file and not is_allowed_document(uploaded_file):
+        return jsonify({"ok": False, "error": "Document must be a PDF, JPEG or PNG file"}), 415
 
+    # The row is inserted first so a ticket number collision can be retried
+    # with a fresh number; the document is written inside the same
+    # transaction and only committed together with it
+    file_name = uploaded_file.filename if has_file else None
+    file_path = None
+    conn = get_db()
+    cursor = conn.cursor()
     try:
-        cursor.execute("""
-            INSERT INTO applications (service_id, name, email, phone, purpose, ticket_number, file_name, file_data)
-            VALUES (?, ?, ?, ?, ?, ?, ?, ?)
-        """, (service_id, name, email, phone, purpose, ticket_number, file_name, file_data))
-        conn.commit()
-    except sqlite3.Error as e:
-        conn.close()
-        print(f"Database error on application insert: {e}")
+        cursor.execute("BEGIN")
+        for _ in range(TICKET_ATTEMPTS):
+            ticket_number = generate_ticket()
+            file_path = f"{ticket_number}_{secure_filename(file_name) or 'document'}" if has_file else None
+            cursor.execute(SQL_INSERT_APP, (service_id, name, email, phone, purpose, ticket_number, file_name, file_path))
+            row = cursor.fetchone()
+            if row is not None:
+                break
+        else:
+            cursor.execute("ROLLBACK")
+            print("Could not allocate a unique ticket number")
+            return jsonify({"ok": False, "error": "A database error occurred. Please try again."}), 500
+
+        # Uploads are copied to disk 1 MB at a time; the table only records where they are
+        if has_file:
+            with open(os.path.join(UPLOAD_DIR, file_path), "wb") as f:
+                shutil.copyfileobj(uploaded_file.stream, f, COPY_CHUNK_SIZE)
+                file_size = f.tell()
+            cursor.execute(SQL_SET_FILE_SIZE, (file_size, row["id"]))
+        cursor.execute("COMMIT")
+    except (sqlite3.Error, OSError) as e:
+        print(f"Error on application insert: {e}")
+        if conn.in_transaction:
+            conn.rollback()
+        if file_path:
+            with contextlib.suppress(FileNotFoundError):
+                os.remove(os.path.join(UPLOAD_DIR, file_path))
         return jsonify({"ok": False, "error": "A database error occurred. Please try again."}), 500
-    finally:
-        conn.close()
 
     return jsonify({"ok": True, "message": "Application submitted successfully!", "ticket_number": ticket_number})
 
 
 @app.route("/api/saved_files")
 def api_saved_files():
-    """Return saved uploads. If ?email= is provided, filter by user email."""
+    """
+    Return saved uploads, newest first. If ?email= is provided, filter by
+    user email. Results come in pages of ?page_size= (default 50); pass the
+    returned next_cursor as ?cursor= to get the following page.
+    """
     email = request.args.get('email', '').strip()
+    page_size = request.args.get('page_size', SAVED_FILES_PAGE_SIZE, type=int)
+    page_size = max(1, min(page_size, SAVED_FILES_MAX_PAGE_SIZE))
+    after = None
+    cursor_arg = request.args.get('cursor', '')
+    if cursor_arg:
+        # "<submission_date>|<id>" of the last row already sent
+        submitted_at, _, last_id = cursor_arg.rpartition('|')
+        if not submitted_at or not last_id.isdigit():
+            return jsonify({"ok": False, "error": "Invalid cursor"}), 400
+        after = (submitted_at, int(last_id))
     conn = get_db()
     cursor = conn.cursor()
     try:
+        # Cheap aggregate first: if nothing changed since the client's copy,
+        # answer 304 without reading or serializing the rows
         if email:
-            cursor.execute("""
-                SELECT id, service_id, name, email, ticket_number, file_name, file_data, submission_date
-                FROM applications
-                WHERE file_data IS NOT NULL AND email = ?
-                ORDER BY submission_date DESC
-                LIMIT 200
-            """, (email,))
+            cursor.execute(SQL_SAVED_VERSION_BY_EMAIL, (email,))
+        else:
+            cursor.execute(SQL_SAVED_VERSION_ALL)
+        etag = make_etag(email, cursor_arg, page_size, *cursor.fetchone())
+        if request.if_none_match.contains(etag):
+            return not_modified(etag)
+
+        # One row more than the page shows whether another page follows
+        if email and after:
+            cursor.execute(SQL_SAVED_BY_EMAIL_AFTER, (email, *after, page_size + 1))
+        elif email:
+            cursor.execute(SQL_SAVED_BY_EMAIL, (email, page_size + 1))
+        elif after:
+            cursor.execute(SQL_SAVED_ALL_AFTER, (*after, page_size + 1))
         else:
-            cursor.execute("""
-                SELECT id, service_id, name, email, ticket_number, file_name, file_data, submission_date
-                FROM applications
-                WHERE file_data IS NOT NULL
-                ORDER BY submission_date DESC
-                LIMIT 200
-            """)
+            cursor.execute(SQL_SAVED_ALL, (page_size + 1,))
         rows = cursor.fetchall()
+        next_cursor = None
+        if len(rows) > page_size:
+            rows = rows[:page_size]
+            next_cursor = f"{rows[-1]['submission_date']}|{rows[-1]['id']}"
         results = []
         for row in rows:
             results.append({
@@ -259,57 +978,297 @@ def api_saved_files():
                 'file_name': row['file_name'],
                 'submitted_at': row['submission_date']
             })
-        return jsonify({'ok': True, 'files': results})
+        response = fast_jsonify({'ok': True, 'files': results, 'next_cursor': next_cursor})
+        response.set_etag(etag)
+        response.headers['Cache-Control'] = 'no-cache'
+        return response
     except sqlite3.Error as e:
         print(f"Database error on saved files query: {e}")
         return jsonify({"ok": False, "error": "Could not retrieve saved files"}), 500
-    finally:
-        conn.close()
 
 # ---- Chatbot endpoint ----
 @app.route("/api/chat", methods=["POST"])
 def api_chat():
+    """
+    Answers a chat message. By default the reply is streamed as server-sent
+    events ({"token": ...} frames followed by a final {"done": true} frame);
+    send "stream": false to get a single JSON response instead.
+
+    Gemini reads the message and replies in the requested language in a
+    single call. ?force_pivot_translate=true instead translates the message
+    to English and the reply back through OpenRouter, for comparison.
+    """
     data = request.get_json(silent=True) or {}
     message = (data.get("message") or "").strip()
     if not message:
         return jsonify({"ok": False, "error": "message is required"}), 400
 
-    bot_reply = ask_gemini(message)
-    return jsonify({"ok": True, "bot_reply": bot_reply})
+    # A session id continues a conversation only if it was issued here;
+    # anything else starts a new one under a fresh id
+    session_id = data.get("session_id")
+    if session_id is not None and (not isinstance(session_id, str) or len(session_id) > SESSION_ID_MAX_LENGTH):
+        return jsonify({"ok": False, "error": "session_id must be a string returned by a previous reply"}), 400
+    if session_id and is_issued_session_id(session_id):
+        history = load_chat_history(session_id)
+    else:
+        session_id, history = issue_session_id(), []
+    # Language codes name cache scopes, so only the supported ones are accepted
+    languages = []
+    for field in ("source_language", "target_language"):
+        language = data.get(field) or ""
+        language = language.strip().lower() if isinstance(language, str) else None
+        if language is None or (language and language not in LANGUAGE_NAMES):
+            return jsonify({"ok": False, "error": f"{field} must be one of: {', '.join(LANGUAGE_NAMES)}"}), 400
+        languages.append(language)
+    source_language, target_language = languages
+    pivot = request.args.get("force_pivot_translate") == "true"
+    translator = get_translator() if pivot else None
+
+    if pivot:
+        if not source_language:
+            source_language = translator.detect_language(message) if translator else "en"
+        target_language = target_language or source_language
+        question = translate_text(message, source_language, "en")
+        asked, scope, semantic = question, "en", True
+    else:
+        question = build_chat_prompt(message, source_language, target_language)
+        # Cached by the citizen's own words, per language pair. With neither
+        # language given the reply follows the question's language, which a
+        # multilingual embedding does not tell apart, so only exact matches count
+        asked, scope = message, f"{source_language}:{target_language}"
+        semantic = bool(source_language or target_language)
+    translate_reply = pivot and translator is not None and target_language != "en"
+
+    if not data.get("stream", True):
+        bot_reply = ask_gemini(question, asked, scope, history, semantic)
+        if translate_reply:
+            bot_reply = translate_text(bot_reply, "en", target_language)
+        save_chat(session_id, message, bot_reply, source_language or None, target_language or None)
+        return fast_jsonify({"ok": True, "bot_reply": bot_reply, "session_id": session_id})
+
+    def generate():
+        reply_parts = []
+        try:
+            if not translate_reply:
+                for chunk in ask_gemini_stream(question, asked, scope, history, semantic):
+                    reply_parts.append(chunk)
+                    yield sse_event({"token": chunk})
+            else:
+                # Each sentence is sent for translation as soon as Gemini finishes
+                # it; translations run concurrently with decoding and with each
+                # other, and are emitted in order as they complete
+                pending = collections.deque()
+                buffer = ""
+                for chunk in ask_gemini_stream(question, asked, scope, history, semantic):
+                    sentences, buffer = split_sentences(buffer + chunk)
+                    for sentence, separator in sentences:
+                        pending.append((translator.submit_translation(sentence, "en", target_language), separator))
+                    while pending and pending[0][0].done():
+                        future, separator = pending.popleft()
+                        piece = future.result() + separator
+                        reply_parts.append(piece)
+                        yield sse_event({"token": piece})
+                if buffer.strip():
+                    pending.append((translator.submit_translation(buffer, "en", target_language), ""))
+                for future, separator in pending:
+                    piece = future.result() + separator
+                    reply_parts.append(piece)
+                    yield sse_event({"token": piece})
+            yield sse_event({"done": True, "session_id": session_id})
+        finally:
+            # Runs once the stream closes, including when the client disconnects
+            save_chat(session_id, message, "".join(reply_parts), source_language or None, target_language or None)
+
+    return Response(
+        stream_with_context(generate()),
+        mimetype="text/event-stream",
+        headers={"Cache-Control": "no-cache", "X-Accel-Buffering": "no"}
+    )
 
 # (All other existing API endpoints for complaints, history, voice, etc. should remain unchanged)
 
 
 
+# ---- Speech to text ----
+@app.route("/api/voice", methods=["POST"])
+def voice_to_text():
+    """
+    Transcribes an uploaded recording ('audio' file field). The optional
+    'language' field takes an ISO 639-1 code, or 'auto' to detect it.
+    With 'stream' set, each transcribed segment is sent as a server-sent
+    event as soon as it is decoded.
+    """
+    audio = request.files.get("audio")
+    if not audio:
+        return jsonify({"ok": False, "error": "audio file is required"}), 400
+    whisper_model = get_whisper_model()
+    if not whisper_model:
+        return jsonify({"ok": False, "error": "Speech recognition is not available"}), 503
+
+    lang = (request.form.get("language") or "auto").strip().lower()
+    if lang != "auto" and lang not in whisper_model.supported_languages:
+        return jsonify({"ok": False, "error": f"Language not supported: {lang}"}), 400
+    try:
+        segments, info = whisper_model.transcribe(
+            audio.stream,
+            language=None if lang == "auto" else lang,
+            beam_size=1,
+            vad_filter=True,
+            condition_on_previous_text=False
+        )
+    except ValueError as e:
+        return jsonify({"ok": False, "error": str(e)}), 400
+    except Exception as e:
+        print(f"Speech recognition error: {e}")
+        return jsonify({"ok": False, "error": "Could not process the audio"}), 500
+
+    # segments is lazy: the audio is decoded while it is iterated, so
+    # decoding errors surface here rather than in transcribe()
+    if request.form.get("stream"):
+        def generate():
+            try:
+                for segment in segments:
+                    yield sse_event({"text": segment.text})
+            except Exception as e:
+                print(f"Speech recognition error: {e}")
+                yield sse_event({"error": "Could not process the audio"})
+                return
+            yield sse_event({"done": True, "language": info.language})
+
+        return Response(
+            stream_with_context(generate()),
+            mimetype="text/event-stream",
+            headers={"Cache-Control": "no-cache", "X-Accel-Buffering": "no"}
+        )
+
+    try:
+        text = "".join(segment.text for segment in segments).strip()
+    except Exception as e:
+        print(f"Speech recognition error: {e}")
+        return jsonify({"ok": False, "error": "Could not process the audio"}), 500
+    return jsonify({"ok": True, "text": text, "language": info.language})
+
+# ---- Text to speech ----
+TTS_CACHE_MAX_CHARS = 300  # Only short, often repeated phrases are kept on disk
+# Clips kept on disk; the least recently played are removed beyond this
+TTS_CACHE_MAX_FILES = 500
+# The URL carries the text and language, so the audio behind a cached clip never changes
+TTS_CACHE_CONTROL = "public, max-age=31536000, immutable"
+
+def prune_tts_cache():
+    """Removes the least recently used clips once TTS_DIR holds more than TTS_CACHE_MAX_FILES."""
+    with os.scandir(TTS_DIR) as entries:
+        clips = [(entry.stat().st_atime, entry.path) for entry in entries if entry.name.endswith(".mp3")]
+    if len(clips) <= TTS_CACHE_MAX_FILES:
+        return
+    clips.sort()
+    for _, path in clips[:len(clips) - TTS_CACHE_MAX_FILES]:
+        with contextlib.suppress(FileNotFoundError):
+            os.remove(path)
+
+@app.route("/api/tts")
+def text_to_speech():
+    """
+    Speaks ?text= in ?lang= as MP3. The audio is streamed while gTTS is still
+    synthesizing it, so it can be used directly as an <audio> source.
+    """
+    text = (request.args.get("text") or "").strip()
+    lang = (request.args.get("lang") or "en").strip().lower()
+    if not text:
+        return jsonify({"ok": False, "error": "text is required"}), 400
+    gTTS = get_gtts()
+    if gTTS is None:
+        return jsonify({"ok": False, "error": "Text-to-speech is not available"}), 503
+
+    cacheable = len(text) <= TTS_CACHE_MAX_CHARS
+    cache_name = hashlib.sha1(f"{lang}:{text}".encode("utf-8")).hexdigest() + ".mp3"
+    cache_path = os.path.join(TTS_DIR, cache_name)
+    if cacheable and os.path.exists(cache_path):
+        # Setting the access time marks the clip as recently used for
+        # prune_tts_cache(); the mtime, which the ETag is built from, is kept
+        with contextlib.suppress(FileNotFoundError):
+            os.utime(cache_path, (time.time(), os.stat(cache_path).st_mtime))
+        # conditional=True answers If-None-Match with 304 and supports Range
+        # requests, so players can seek without fetching the whole clip again
+        response = send_from_directory(TTS_DIR, cache_name, mimetype="audio/mpeg", conditional=True, max_age=31536000)
+        response.headers["Cache-Control"] = TTS_CACHE_CONTROL
+        return response
+
+    try:
+        tts = gTTS(text=text, lang=lang)
+    except ValueError as e:
+        return jsonify({"ok": False, "error": str(e)}), 400
+
+    # The first chunk is fetched before any header is sent, so a failed
+    # synthesis is reported as an error instead of an empty 200 clip
+    chunks = tts.stream()
+    try:
+        first_chunk = next(chunks)
+    except Exception as e:
+        print(f"TTS error: {e}")
+        return jsonify({"ok": False, "error": "Text-to-speech failed, please try again"}), 502
+
+    def generate():
+        partial_path = f"{cache_path}.{uuid.uuid4().hex}.part"
+        cache_file = open(partial_path, "wb") if cacheable else None
+        try:
+            for chunk in itertools.chain([first_chunk], chunks):
+                if cache_file:
+                    cache_file.write(chunk)
+                yield chunk
+            if cache_file:
+                cache_file.close()
+                os.replace(partial_path, cache_path)
+                prune_tts_cache()
+        except Exception as e:
+            print(f"TTS error: {e}")
+        finally:
+            if cache_file:
+                cache_file.close()
+                if os.path.exists(partial_path):
+                    os.remove(partial_path)
+
+    return Response(
+        stream_with_context(generate()),
+        mimetype="audio/mpeg",
+        # Only clips served from the disk cache are known to be complete
+        headers={"Content-Disposition": "inline; filename=tts.mp3", "Cache-Control": "no-store"}
+    )
+
 # ---- Download a saved file by database id ----
 @app.route('/api/download/<int:file_id>')
 def download_file(file_id):
     conn = get_db()
     cursor = conn.cursor()
     try:
-        cursor.execute("""
-            SELECT file_name, file_data
-            FROM applications
-            WHERE id = ?
-        """, (file_id,))
+        cursor.execute(SQL_DOWNLOAD, (file_id,))
         row = cursor.fetchone()
-        if not row or not row['file_data']:
+        if not row or not row['file_path']:
             return jsonify({'ok': False, 'error': 'File not found'}), 404
         
         filename = row['file_name'] or f'file_{file_id}'
-        data = row['file_data']
-        return send_file(
-            io.BytesIO(data),
+        # Sending by path lets the WSGI server hand the open file to
+        # wsgi.file_wrapper (sendfile(2) under gunicorn) or to X-Sendfile,
+        # instead of copying it through Python; conditional=True adds
+        # Range support so interrupted downloads can resume
+        return send_from_directory(
+            UPLOAD_DIR,
+            row['file_path'],
             as_attachment=True,
             download_name=filename,
-            mimetype='application/octet-stream'
+            mimetype='application/octet-stream',
+            conditional=True
         )
+    except NotFound:
+        return jsonify({'ok': False, 'error': 'File not found'}), 404
     except sqlite3.Error as e:
         print(f"Database error on download: {e}")
         return jsonify({'ok': False, 'error': 'Could not download file'}), 500
-    finally:
-        conn.close()
 if __name__ == "__main__":
+    # The Werkzeug server handles one request at a time per thread and blocks
+    # on every Gemini/OpenRouter call; production runs under gunicorn (wsgi.py)
+    if os.environ.get("FLASK_ENV") != "dev":
+        raise SystemExit("Run with gunicorn (see wsgi.py), or set FLASK_ENV=dev to use the development server.")
     host = os.environ.get("FLASK_RUN_HOST", "0.0.0.0")
     port = int(os.environ.get("FLASK_RUN_PORT", "5000"))
-    app.run(host=host, port=port, debug=True)
\ No newline at end of file
+    app.run(host=host, port=port, debug=True)
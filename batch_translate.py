@@ -0,0 +1,159 @@
+"""
+Bulk-translates stored chat replies with the Gemini Batch API.
+
+Live chat keeps using the synchronous translator; this script is meant to
+be run from a scheduled job. Batch requests are billed at half the normal
+per-token price and complete within 24 hours.
+
+    python batch_translate.py submit --lang hi --lang ta
+    python batch_translate.py collect <batch_id>
+
+Submitted rows are marked with their batch id in pending_<lang> until the
+batch is collected, so running submit again before then does not send
+them twice. Rows a finished batch did not translate are submitted again.
+"""
+
+import os
+import io
+import json
+import sqlite3
+import argparse
+
+import openai
+from dotenv import load_dotenv
+
+from OpenRouterTranslate import SUPPORTED_LANGUAGES, translation_messages
+
+BASE_DIR = os.path.dirname(os.path.abspath(__file__))
+DB_PATH = os.path.join(BASE_DIR, "data.db")
+GEMINI_OPENAI_URL = "https://generativelanguage.googleapis.com/v1beta/openai/"
+BATCH_MODEL = "gemini-1.5-flash"
+
+TARGET_LANGUAGES = [code for code in SUPPORTED_LANGUAGES if code != "en"]
+# Batches in these states will not produce any more results
+FINISHED_STATUSES = {"completed", "failed", "expired", "cancelled"}
+
+def get_client():
+    load_dotenv()
+    return openai.OpenAI(base_url=GEMINI_OPENAI_URL, api_key=os.environ["GEMINI_API_KEY"])
+
+def ensure_columns(conn, languages):
+    """Adds the translated_<lang> and pending_<lang> columns to chat_history for each language that lacks them."""
+    existing = {row[1] for row in conn.execute("PRAGMA table_info(chat_history)")}
+    for lang in languages:
+        for column in (f"translated_{lang}", f"pending_{lang}"):
+            if column not in existing:
+                conn.execute(f"ALTER TABLE chat_history ADD COLUMN {column} TEXT")
+    conn.commit()
+
+def release_pending(conn, batch_id):
+    """Clears the pending marks of a batch, so its untranslated rows can be submitted again."""
+    columns = [row[1] for row in conn.execute("PRAGMA table_info(chat_history)") if row[1].startswith("pending_")]
+    for column in columns:
+        conn.execute(f"UPDATE chat_history SET {column} = NULL WHERE {column} = ?", (batch_id,))
+    conn.commit()
+
+def submit(languages):
+    """Uploads every untranslated reply not already in a batch as one batch job and prints its id."""
+    conn = sqlite3.connect(DB_PATH)
+    ensure_columns(conn, languages)
+
+    lines = []
+    submitted = {}
+    for lang in languages:
+        # Replies are stored in the language they were sent in: target_lang,
+        # else the question's language, else English. Replies already in
+        # the requested language are skipped
+        rows = conn.execute(f"""
+            SELECT id, bot_message, reply_lang FROM (
+                SELECT id, bot_message, COALESCE(target_lang, source_lang, 'en') AS reply_lang
+                FROM chat_history
+                WHERE translated_{lang} IS NULL AND pending_{lang} IS NULL AND bot_message != ''
+            )
+            WHERE reply_lang != ?
+        """, (lang,))
+        for row_id, bot_message, reply_lang in rows:
+            submitted.setdefault(lang, []).append(row_id)
+            lines.append(json.dumps({
+                "custom_id": f"{row_id}:{lang}",
+                "method": "POST",
+                "url": "/v1/chat/completions",
+                "body": {
+                    "model": BATCH_MODEL,
+                    "messages": translation_messages(bot_message, reply_lang, lang),
+                    "temperature": 0.3,
+                },
+            }, ensure_ascii=False))
+
+    if not lines:
+        conn.close()
+        print("Nothing to translate.")
+        return
+
+    client = get_client()
+    batch_file = client.files.create(
+        file=("chat_history.jsonl", io.BytesIO("\n".join(lines).encode("utf-8"))),
+        purpose="batch",
+    )
+    batch = client.batches.create(
+        input_file_id=batch_file.id,
+        endpoint="/v1/chat/completions",
+        completion_window="24h",
+    )
+    for lang, row_ids in submitted.items():
+        conn.executemany(f"UPDATE chat_history SET pending_{lang} = ? WHERE id = ?",
+                         [(batch.id, row_id) for row_id in row_ids])
+    conn.commit()
+    conn.close()
+    print(f"Submitted {len(lines)} translations as batch {batch.id}")
+
+def collect(batch_id):
+    """Stores the results of a finished batch job in chat_history."""
+    client = get_client()
+    batch = client.batches.retrieve(batch_id)
+    if batch.status not in FINISHED_STATUSES:
+        print(f"Batch {batch_id} is {batch.status}, try again later.")
+        return
+    if batch.status != "completed":
+        conn = sqlite3.connect(DB_PATH)
+        release_pending(conn, batch_id)
+        conn.close()
+        print(f"Batch {batch_id} is {batch.status}; its rows will be submitted again.")
+        return
+
+    updates = {}
+    for line in client.files.content(batch.output_file_id).text.splitlines():
+        if not line.strip():
+            continue
+        result = json.loads(line)
+        row_id, lang = result["custom_id"].split(":")
+        response = result.get("response") or {}
+        if response.get("status_code") != 200:
+            print(f"Skipping {result['custom_id']}: {result.get('error') or response}")
+            continue
+        translated = response["body"]["choices"][0]["message"]["content"].strip()
+        updates.setdefault(lang, []).append((translated, int(row_id)))
+
+    conn = sqlite3.connect(DB_PATH)
+    ensure_columns(conn, updates)
+    for lang, rows in updates.items():
+        conn.executemany(f"UPDATE chat_history SET translated_{lang} = ? WHERE id = ?", rows)
+    conn.commit()
+    release_pending(conn, batch_id)
+    conn.close()
+    print(f"Stored {sum(len(rows) for rows in updates.values())} translations from batch {batch_id}")
+
+if __name__ == "__main__":
+    parser = argparse.ArgumentParser(description=__doc__, formatter_class=argparse.RawDescriptionHelpFormatter)
+    commands = parser.add_subparsers(dest="command", required=True)
+    submit_parser = commands.add_parser("submit", help="queue untranslated replies for translation")
+    submit_parser.add_argument("--lang", action="append", choices=TARGET_LANGUAGES,
+                               help="target language (repeatable, default: all supported languages)")
+    collect_parser = commands.add_parser("collect", help="store the results of a finished batch")
+    collect_parser.add_argument("batch_id")
+    args = parser.parse_args()
+
+    if args.command == "submit":
+        submit(args.lang or TARGET_LANGUAGES)
+    else:
+        collect(args.batch_id)
@@ -0,0 +1,18 @@
+"""gunicorn settings, picked up automatically by `gunicorn wsgi:app`."""
+
+import multiprocessing
+
+# Import the app (and its templates, SQL and services cache) once in the
+# master; forked workers share those pages copy-on-write. Models are loaded
+# lazily, so each worker loads its own on first use.
+preload_app = True
+
+# One process per CPU, each with a thread pool: requests mostly wait on
+# Gemini/OpenRouter, and a streamed chat reply holds its thread until done
+workers = multiprocessing.cpu_count()
+worker_class = "gthread"
+threads = 8
+
+bind = "0.0.0.0:5000"
+timeout = 60
+keepalive = 5
@@ -2,6 +2,9 @@ import sqlite3
 
 # Connect to (or create) SQLite DB
 conn = sqlite3.connect("data.db")
+# One-off bulk load: skip the per-commit fsync, WAL matches the app's connections
+conn.execute("PRAGMA journal_mode=WAL")
+conn.execute("PRAGMA synchronous=OFF")
 cursor = conn.cursor()
 
 # ---- Create services table if it doesn't exist ----
@@ -65,8 +68,14 @@ services_data = [
 ]
 
 # ---- Insert services into DB ----
-cursor.executemany("INSERT OR IGNORE INTO services (service_id, title, details) VALUES (?, ?, ?)", services_data)
+# All rows go in one transaction, and a re-run against an already
+# populated table inserts nothing
+count = cursor.execute("SELECT COUNT(*) FROM services").fetchone()[0]
+if count == len(services_data):
+    print("Services table already populated, nothing to do.")
+else:
+    with conn:
+        cursor.executemany("INSERT OR IGNORE INTO services (service_id, title, details) VALUES (?, ?, ?)", services_data)
+    print("SQLite database populated with all services successfully!")
 
-conn.commit()
 conn.close()
-print("SQLite database populated with all services successfully!")
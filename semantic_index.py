@@ -0,0 +1,49 @@
+"""
+Nearest-question lookup for the semantic tier of the Gemini answer cache
+(AnswerCache in app.py). Imported only when sentence-transformers, and
+with it numpy, is installed.
+"""
+
+import numpy as np
+
+
+class SemanticIndex:
+    """
+    One scope's question embeddings (unit length) and their answers, kept
+    in a ring buffer: new rows are written in place, and once it holds
+    max_rows rows each one replaces the oldest. The buffer starts small and
+    doubles up to max_rows, so rarely used scopes stay small.
+    """
+    def __init__(self, dimensions, max_rows, threshold, capacity=64):
+        self.max_rows = max_rows
+        self.threshold = threshold
+        capacity = min(capacity, max_rows)
+        self.matrix = np.empty((capacity, dimensions), dtype=np.float32)
+        self.answers = [None] * capacity
+        self.count = 0
+        self.position = 0
+
+    def add(self, answer, embedding):
+        capacity = len(self.answers)
+        if self.count == capacity < self.max_rows:
+            # A full buffer below max_rows grows instead of wrapping: the rows
+            # are copied once per doubling and the next one goes after them
+            capacity = min(capacity * 2, self.max_rows)
+            matrix = np.empty((capacity, self.matrix.shape[1]), dtype=np.float32)
+            matrix[:self.count] = self.matrix
+            self.matrix = matrix
+            self.answers.extend([None] * (capacity - self.count))
+            self.position = self.count
+        self.matrix[self.position] = embedding
+        self.answers[self.position] = answer
+        self.position = (self.position + 1) % capacity
+        self.count = min(self.count + 1, capacity)
+
+    def closest(self, embedding):
+        """Returns the answer to the most similar question, if it reaches the threshold."""
+        if not self.count:
+            return None
+        # Embeddings are unit length, so the dot product is the cosine similarity
+        scores = self.matrix[:self.count] @ embedding
+        best = int(scores.argmax())
+        return self.answers[best] if scores[best] >= self.threshold else None
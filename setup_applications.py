@@ -1,5 +1,8 @@
+import os
 import sqlite3
 
+UPLOAD_DIR = "uploads"
+
 conn = sqlite3.connect("data.db")
 cursor = conn.cursor()
 
@@ -14,20 +17,50 @@ CREATE TABLE IF NOT EXISTS applications (
     purpose TEXT,
     ticket_number TEXT UNIQUE,
     status TEXT DEFAULT 'Submitted',
-    submission_date TIMESTAMP DEFAULT CURRENT_TIMESTAMP
+    submission_date TIMESTAMP DEFAULT CURRENT_TIMESTAMP,
+    file_name TEXT,
+    file_data BLOB,
+    file_path TEXT,
+    file_size INTEGER
 )
 """)
 
-# Ensure file columns exist
-def column_exists(table, col):
-    cursor.execute(f"PRAGMA table_info({table})")
-    return any(row[1] == col for row in cursor.fetchall())
+# Tables created by older versions lack the file columns; adding one that
+# already exists raises OperationalError, which is cheaper than probing
+# PRAGMA table_info first
+for column in ("file_name TEXT", "file_data BLOB", "file_path TEXT", "file_size INTEGER"):
+    try:
+        cursor.execute(f"ALTER TABLE applications ADD COLUMN {column}")
+    except sqlite3.OperationalError:
+        pass
 
-if not column_exists('applications', 'file_name'):
-    cursor.execute("ALTER TABLE applications ADD COLUMN file_name TEXT")
-if not column_exists('applications', 'file_data'):
-    cursor.execute("ALTER TABLE applications ADD COLUMN file_data BLOB")
+# Move documents stored as BLOBs (older versions) out to UPLOAD_DIR;
+# file_path is relative to UPLOAD_DIR, as written by the app
+os.makedirs(UPLOAD_DIR, exist_ok=True)
+cursor.execute("""
+    SELECT id, ticket_number, file_name FROM applications
+    WHERE file_data IS NOT NULL AND file_path IS NULL
+""")
+for app_id, ticket_number, file_name in cursor.fetchall():
+    file_path = f"{ticket_number or app_id}_{os.path.basename(file_name or 'document')}"
+    data = cursor.execute("SELECT file_data FROM applications WHERE id = ?", (app_id,)).fetchone()[0]
+    with open(os.path.join(UPLOAD_DIR, file_path), "wb") as f:
+        f.write(data)
+    cursor.execute(
+        "UPDATE applications SET file_path = ?, file_size = ?, file_data = NULL WHERE id = ?",
+        (file_path, len(data), app_id)
+    )
+
+# Saved-files listing: a user's uploaded documents, newest first, with id
+# breaking ties so each page is a plain index range walk (replaces the
+# older two-column index)
+cursor.executescript("""
+    DROP INDEX IF EXISTS idx_apps_email_date;
+    CREATE INDEX IF NOT EXISTS idx_apps_email_date_id
+    ON applications(email, submission_date DESC, id DESC)
+    WHERE file_path IS NOT NULL;
+""")
 
 conn.commit()
 conn.close()
-print("Applications table ensured with file_name and file_data columns!")
+print("Applications table ensured with file_name, file_path and file_size columns!")
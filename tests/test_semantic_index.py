@@ -0,0 +1,32 @@
+import pytest
+
+np = pytest.importorskip("numpy")
+
+from semantic_index import SemanticIndex
+
+
+def unit_rows(count, dimensions=32, seed=0):
+    rows = np.random.default_rng(seed).standard_normal((count, dimensions)).astype(np.float32)
+    return rows / np.linalg.norm(rows, axis=1, keepdims=True)
+
+
+def test_growth_keeps_every_row():
+    rows = unit_rows(300)
+    index = SemanticIndex(rows.shape[1], max_rows=1000, threshold=0.92, capacity=64)
+    for number, row in enumerate(rows):
+        index.add(number, row)
+    assert index.count == len(rows)
+    for number, row in enumerate(rows):
+        assert index.closest(row) == number
+
+
+def test_full_buffer_replaces_oldest():
+    rows = unit_rows(150)
+    index = SemanticIndex(rows.shape[1], max_rows=100, threshold=0.92, capacity=64)
+    for number, row in enumerate(rows):
+        index.add(number, row)
+    assert index.count == 100
+    for row in rows[:50]:
+        assert index.closest(row) is None
+    for number, row in enumerate(rows[50:], start=50):
+        assert index.closest(row) == number
@@ -0,0 +1,11 @@
+"""
+WSGI entry point for production:
+
+    gunicorn wsgi:app
+
+Settings are read from gunicorn.conf.py: one preloaded app forked into a
+worker per CPU, each serving requests on a pool of threads. Downloads go
+out through gunicorn's wsgi.file_wrapper, which uses sendfile(2).
+"""
+
+from app import app  # noqa: F401